@@ -4,8 +4,10 @@ import os
 import requests
 import json
 from datetime import datetime, timedelta
-from threading import Thread
-from pymongo import MongoClient
+from threading import Thread, Lock, Event
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient, ASCENDING, DESCENDING
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import uuid
@@ -44,10 +46,33 @@ users_collection = db.users
 chat_history_collection = db.chat_history
 conversations_collection = db.conversations
 
+# Sidebar listing reads conversations by most recent activity
+try:
+    conversations_collection.create_index([('user_id', ASCENDING), ('updated_at', DESCENDING)])
+except Exception as e:
+    print(f"Error creating conversation indexes: {e}")
+
 # Groq API Configuration
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 GROQ_API_URL = 'https://api.groq.com/openai/v1/chat/completions'
 
+# Speculative TTS prefetch configuration
+TTS_PREFETCH_MAX_ENTRIES = int(os.getenv('TTS_PREFETCH_MAX_ENTRIES', '64'))
+TTS_PREFETCH_TTL_SECONDS = int(os.getenv('TTS_PREFETCH_TTL_SECONDS', '300'))
+TTS_PREFETCH_WORKERS = int(os.getenv('TTS_PREFETCH_WORKERS', '4'))
+# How long /tts waits on an in-flight prefetch. The client's audio load timeout is 10s
+# (static/chat.js speakText); waiting up to 8s leaves ~2s for transferring the audio
+# before the browser gives up and falls back to Web Speech.
+TTS_PREFETCH_WAIT_SECONDS = float(os.getenv('TTS_PREFETCH_WAIT_SECONDS', '8'))
+
+# audio_id -> {'text', 'event', 'audio', 'error', 'created_at', 'served'}
+tts_prefetch_cache = OrderedDict()
+tts_prefetch_lock = Lock()
+tts_prefetch_stats = {'started': 0, 'served': 0, 'unused_evicted': 0, 'failed': 0, 'skipped': 0, 'timed_out': 0}
+# Bounded pool so evicted-but-running prefetches cannot pile up unbounded gTTS work
+tts_prefetch_executor = ThreadPoolExecutor(max_workers=TTS_PREFETCH_WORKERS, thread_name_prefix='tts-prefetch')
+tts_prefetch_in_flight = 0
+
 @app.route('/api/save_chat', methods=['POST'])
 def save_chat_to_db():
     if 'user_id' not in session:
@@ -67,6 +92,8 @@ def save_chat_to_db():
             'sender': sender,
             'timestamp': timestamp
         })
+        if conversation_id:
+            record_conversation_activity(session['user_id'], conversation_id, 1, message, timestamp)
         return jsonify({'success': True, 'message': 'Chat saved successfully'})
     except Exception as e:
         print(f"Error saving chat: {e}")
@@ -95,6 +122,62 @@ def serialize_documents(documents, datetime_fields):
     return serialized
 
 
+def make_message_preview(message, limit=100):
+    """Truncate a message for display in the conversation sidebar."""
+    message = (message or '').strip()
+    return message[:limit] + '...' if len(message) > limit else message
+
+
+def record_conversation_activity(user_id, conversation_id, added_messages, last_message, timestamp):
+    """Atomically bump the denormalized counters on a conversation document."""
+    conversations_collection.update_one(
+        {'conversation_id': conversation_id, 'user_id': user_id},
+        {
+            '$inc': {'message_count': added_messages},
+            '$set': {
+                'updated_at': timestamp,
+                'last_message_preview': make_message_preview(last_message),
+            }
+        }
+    )
+
+
+def backfill_conversation_counters():
+    """Populate message_count, updated_at and last_message_preview from chat_history.
+
+    One-off migration for conversations written before these fields were maintained.
+    Run it with the app stopped: turns saved while it runs can be counted twice.
+    Returns the number of conversation documents updated.
+    """
+    updated = 0
+    for convo in conversations_collection.find({}):
+        query = {'conversation_id': convo.get('conversation_id'), 'user_id': convo.get('user_id')}
+        count = chat_history_collection.count_documents(query)
+        latest = list(chat_history_collection.find(query, {'message': 1, 'timestamp': 1})
+                      .sort('timestamp', -1).limit(1))
+        fields = {
+            'message_count': count,
+            'updated_at': (latest[0].get('timestamp') if latest else None) or convo.get('created_at'),
+            'last_message_preview': make_message_preview(latest[0].get('message')) if latest else '',
+        }
+        # Seed the summarizer's last-seen count from the messages that existed when it last ran
+        summary_updated_at = convo.get('summary_updated_at')
+        if isinstance(summary_updated_at, datetime) and 'summary_message_count' not in convo:
+            fields['summary_message_count'] = chat_history_collection.count_documents(
+                dict(query, timestamp={'$lte': summary_updated_at})
+            )
+        conversations_collection.update_one({'_id': convo['_id']}, {'$set': fields})
+        updated += 1
+    return updated
+
+
+@app.cli.command('backfill-conversations')
+def backfill_conversations_command():
+    """Backfill denormalized conversation counters: flask --app main backfill-conversations"""
+    updated = backfill_conversation_counters()
+    print(f"Backfilled {updated} conversations")
+
+
 def call_groq_chat(messages, max_tokens=300, temperature=0.2):
     """Helper to call Groq Chat Completions safely."""
     if not GROQ_API_KEY or GROQ_API_KEY.strip().lower() in {'', 'none', 'your_groq_api_key_here'}:
@@ -124,10 +207,11 @@ def maybe_update_conversation_summary_async(user_id: str, conversation_id: str)
             convo = conversations_collection.find_one({'conversation_id': conversation_id, 'user_id': user_id})
             now = datetime.utcnow()
             last_updated = convo.get('summary_updated_at') if convo else None
-            last_count = convo.get('message_count', 0) if convo else 0
+            # Conversations summarized before the backfill still carry the last-seen count in message_count
+            last_count = convo.get('summary_message_count', convo.get('message_count', 0)) if convo else 0
 
-            # Count messages and fetch recent for summary
-            count = chat_history_collection.count_documents({'conversation_id': conversation_id, 'user_id': user_id})
+            # Denormalized counter maintained by save_conversation
+            count = convo.get('message_count', 0) if convo else 0
             # Throttle: update at most every 15 minutes and at least every +15 msgs to reduce processing load
             if last_updated and isinstance(last_updated, datetime):
                 if now - last_updated < timedelta(minutes=15) and count < last_count + 15:
@@ -171,7 +255,7 @@ def maybe_update_conversation_summary_async(user_id: str, conversation_id: str)
                 {'$set': {
                     'summary': summary,
                     'summary_updated_at': now,
-                    'message_count': count,
+                    'summary_message_count': count,
                 }}
             )
         except Exception as e:
@@ -180,6 +264,96 @@ def maybe_update_conversation_summary_async(user_id: str, conversation_id: str)
 
     Thread(target=_task, daemon=True).start()
 
+def synthesize_tts(text):
+    """Render text to MP3 bytes with gTTS."""
+    tts = gTTS(text=text, lang='en', slow=False)
+    buf = io.BytesIO()
+    tts.write_to_fp(buf)
+    return buf.getvalue()
+
+
+def _evict_tts_prefetch_locked(now):
+    """Drop expired entries and trim the store to its size bound. Caller holds the lock."""
+    ttl = timedelta(seconds=TTS_PREFETCH_TTL_SECONDS)
+    expired = [key for key, entry in tts_prefetch_cache.items() if now - entry['created_at'] > ttl]
+    for key in expired:
+        entry = tts_prefetch_cache.pop(key)
+        if not entry['served'] and not entry['error']:
+            tts_prefetch_stats['unused_evicted'] += 1
+    while len(tts_prefetch_cache) > TTS_PREFETCH_MAX_ENTRIES:
+        _, entry = tts_prefetch_cache.popitem(last=False)
+        if not entry['served'] and not entry['error']:
+            tts_prefetch_stats['unused_evicted'] += 1
+
+
+def start_tts_prefetch(text):
+    """Begin synthesizing text in the background and return a handle for /tts.
+
+    Returns None without doing any work when every prefetch worker is busy.
+    """
+    global tts_prefetch_in_flight
+    audio_id = str(uuid.uuid4())
+    entry = {
+        'text': text,
+        'event': Event(),
+        'audio': None,
+        'error': None,
+        'created_at': datetime.utcnow(),
+        'served': False,
+    }
+    with tts_prefetch_lock:
+        if tts_prefetch_in_flight >= TTS_PREFETCH_WORKERS:
+            tts_prefetch_stats['skipped'] += 1
+            return None
+        tts_prefetch_in_flight += 1
+        tts_prefetch_cache[audio_id] = entry
+        tts_prefetch_stats['started'] += 1
+        _evict_tts_prefetch_locked(entry['created_at'])
+
+    def _task():
+        global tts_prefetch_in_flight
+        try:
+            entry['audio'] = synthesize_tts(text)
+        except Exception as e:
+            # Best-effort prefetch; /tts falls back to synthesizing on demand
+            entry['error'] = str(e)
+            with tts_prefetch_lock:
+                tts_prefetch_stats['failed'] += 1
+            print(f"TTS prefetch error: {e}")
+        finally:
+            entry['event'].set()
+            with tts_prefetch_lock:
+                tts_prefetch_in_flight -= 1
+
+    tts_prefetch_executor.submit(_task)
+    return audio_id
+
+
+def take_prefetched_tts(audio_id):
+    """Look up prefetched audio for audio_id, waiting if synthesis is still running.
+
+    Returns a (status, audio) pair where status is 'ready', 'pending' (still
+    synthesizing after TTS_PREFETCH_WAIT_SECONDS) or 'missing' (unknown,
+    expired or failed handle).
+    """
+    with tts_prefetch_lock:
+        _evict_tts_prefetch_locked(datetime.utcnow())
+        entry = tts_prefetch_cache.get(audio_id)
+    if not entry:
+        return 'missing', None
+    if not entry['event'].wait(TTS_PREFETCH_WAIT_SECONDS):
+        with tts_prefetch_lock:
+            tts_prefetch_stats['timed_out'] += 1
+        return 'pending', None
+    if entry['audio'] is None:
+        return 'missing', None
+    with tts_prefetch_lock:
+        if not entry['served']:
+            entry['served'] = True
+            tts_prefetch_stats['served'] += 1
+    return 'ready', entry['audio']
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -253,6 +427,8 @@ def chat_api():
 
     data = request.get_json()
     user_message = (data or {}).get('message', '').strip()
+    # Only clients that play server-side TTS will fetch the prefetched audio
+    prefetch_tts = bool((data or {}).get('prefetch_tts'))
 
     if not user_message:
         return jsonify({'success': False, 'message': 'No message provided'})
@@ -267,7 +443,8 @@ def chat_api():
             'user_id': session['user_id'],
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow(),
-            'title': 'New Conversation'
+            'title': 'New Conversation',
+            'message_count': 0
         })
         session['current_conversation_id'] = conversation_id
 
@@ -383,6 +560,9 @@ def chat_api():
         result = response.json()
         ai_response = result['choices'][0]['message']['content'].strip()
 
+        # Start synthesizing the spoken response right away so it overlaps with the DB writes below
+        audio_id = start_tts_prefetch(ai_response) if prefetch_tts else None
+
         # Save conversation to database
         meta = save_conversation(session['user_id'], user_message, ai_response)
         
@@ -399,7 +579,8 @@ def chat_api():
             'success': True, 
             'response': ai_response, 
             'conversation': meta,
-            'conversation_id': conv_id_for_summary or session.get('current_conversation_id')
+            'conversation_id': conv_id_for_summary or session.get('current_conversation_id'),
+            'audio_id': audio_id
         })
 
     except requests.exceptions.RequestException as e:
@@ -418,11 +599,12 @@ def get_chat_history():
         # Get recent conversations for this specific user
         conversations = list(conversations_collection.find(
             {'user_id': user_id},
-            {'_id': 0, 'conversation_id': 1, 'title': 1, 'created_at': 1}
-        ).sort('created_at', -1).limit(50))  # Increased limit to show more history
+            {'_id': 0, 'conversation_id': 1, 'title': 1, 'created_at': 1, 'updated_at': 1,
+             'message_count': 1, 'last_message_preview': 1}
+        ).sort('updated_at', -1).limit(50))  # Most recently active first
         
         # Serialize datetimes
-        conversations = serialize_documents(conversations, ['created_at'])
+        conversations = serialize_documents(conversations, ['created_at', 'updated_at'])
         
         print(f"Found {len(conversations)} conversations for user: {user_id}")
 
@@ -503,7 +685,8 @@ def new_conversation():
             'user_id': session['user_id'],
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow(),
-            'title': 'New Conversation'
+            'title': 'New Conversation',
+            'message_count': 0
         })
         
         # Update session with new conversation ID
@@ -529,7 +712,7 @@ def get_conversation_history(user_id):
         # If no active conversation in session, try to pick the most recent one
         if not conversation_id:
             latest = conversations_collection.find({'user_id': user_id}) \
-                .sort('created_at', -1) \
+                .sort('updated_at', -1) \
                 .limit(1)
             latest_list = list(latest)
             if latest_list:
@@ -595,7 +778,9 @@ def save_conversation(user_id, user_message, ai_response):
                 'conversation_id': conversation_id,
                 'user_id': user_id,
                 'title': conversation_title,
-                'created_at': datetime.utcnow()
+                'created_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow(),
+                'message_count': 0
             })
             print(f"Created new conversation: {conversation_id} for user: {user_id}")
         else:
@@ -617,7 +802,9 @@ def save_conversation(user_id, user_message, ai_response):
                     'conversation_id': conversation_id,
                     'user_id': user_id,
                     'title': conversation_title,
-                    'created_at': datetime.utcnow()
+                    'created_at': datetime.utcnow(),
+                    'updated_at': datetime.utcnow(),
+                    'message_count': 0
                 })
                 print(f"Created new conversation (after verification): {conversation_id} for user: {user_id}")
         
@@ -642,6 +829,9 @@ def save_conversation(user_id, user_message, ai_response):
         }).inserted_id
         
         print(f"Saved AI response: {response_id} in conversation: {conversation_id}")
+
+        # Keep sidebar ordering and summarizer throttle fields current
+        record_conversation_activity(user_id, conversation_id, 2, ai_response, datetime.utcnow())
         
     except Exception as e:
         print(f"Error saving conversation: {e}")
@@ -655,15 +845,19 @@ def save_conversation(user_id, user_message, ai_response):
 
 @app.route('/tts')
 def tts():
+    audio_id = request.args.get('audio_id', '').strip()
     text = request.args.get('text', '').strip()
+    if audio_id:
+        status, audio = take_prefetched_tts(audio_id)
+        if status == 'ready':
+            return send_file(io.BytesIO(audio), mimetype='audio/mpeg')
+        if status == 'pending':
+            # Don't start a second synthesis of the same text; let the client fall back
+            return jsonify({'success': False, 'message': 'TTS still in progress'}), 504
     if not text:
         return jsonify({'success': False, 'message': 'No text provided'}), 400
     try:
-        tts = gTTS(text=text, lang='en', slow=False)
-        buf = io.BytesIO()
-        tts.write_to_fp(buf)
-        buf.seek(0)
-        return send_file(buf, mimetype='audio/mpeg')
+        return send_file(io.BytesIO(synthesize_tts(text)), mimetype='audio/mpeg')
     except Exception as e:
         print(f"Error generating TTS: {e}")
         return jsonify({'success': False, 'message': 'Error generating TTS'}), 500
@@ -677,6 +871,8 @@ def health():
         'mongodb_ok': False,
         'authenticated': 'user_id' in session,
     }
+    with tts_prefetch_lock:
+        status['tts_prefetch'] = dict(tts_prefetch_stats, entries=len(tts_prefetch_cache))
     try:
         # Ping the server to confirm connection
         client.admin.command('ping')
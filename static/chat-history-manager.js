@@ -125,13 +125,21 @@ document.addEventListener('DOMContentLoaded', function() {
                                 (conversation.title.length > 25 ? conversation.title.substring(0, 25) + '...' : conversation.title) : 
                                 'Untitled Conversation';
                             
-                            const displayDate = new Date(conversation.created_at).toLocaleString();
+                            // Sidebar is ordered by last activity, so show that rather than the creation date
+                            const displayDate = new Date(conversation.updated_at || conversation.created_at).toLocaleString();
+                            const countLabel = conversation.message_count ? ` · ${conversation.message_count} messages` : '';
                             
                             // Set the HTML content
                             historyItem.innerHTML = `
                                 <div class="history-title">${displayTitle}</div>
-                                <div class="history-date">${displayDate}</div>
+                                <div class="history-date">${displayDate}${countLabel}</div>
                             `;
+                            if (conversation.last_message_preview) {
+                                const preview = document.createElement('div');
+                                preview.className = 'history-preview';
+                                preview.textContent = conversation.last_message_preview;
+                                historyItem.appendChild(preview);
+                            }
                             
                             // Add click event to load the conversation
                             historyItem.addEventListener('click', () => {
@@ -233,8 +233,8 @@ class VoiceChat {
                 // Add AI response to the UI
                 this.addMessage(response.response, 'ai');
                 
-                // Read response aloud
-                this.speakText(response.response);
+                // Read response aloud, using the server's prefetched audio when available
+                this.speakText(response.response, response.audio_id);
                 
                 // Scroll to the bottom to show new message
                 this.scrollToBottom();
@@ -289,7 +289,7 @@ class VoiceChat {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ message: message }),
+                body: JSON.stringify({ message: message, prefetch_tts: this.useServerTTS }),
                 signal: controller.signal
             });
             
@@ -378,10 +378,11 @@ class VoiceChat {
         }
     }
 
-    async speakText(text) {
+    async speakText(text, audioId) {
         if (this.useServerTTS) {
             try {
-                const url = '/tts?text=' + encodeURIComponent(text);
+                let url = '/tts?text=' + encodeURIComponent(text);
+                if (audioId) url += '&audio_id=' + encodeURIComponent(audioId);
                 console.log('VoiceChat: fetching TTS from', url);
                 const audio = new Audio(url);
                 
@@ -389,6 +390,7 @@ class VoiceChat {
                 await new Promise((resolve, reject) => {
                     audio.oncanplaythrough = resolve;
                     audio.onerror = reject;
+                    // Server waits up to TTS_PREFETCH_WAIT_SECONDS (8s) on a prefetch; the extra ~2s covers transfer
                     setTimeout(() => reject(new Error('Audio load timeout')), 10000); // 10-second timeout
                 });
 